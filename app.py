@@ -3,13 +3,14 @@ from flask import Flask, render_template, request, redirect, url_for, session,js
 from urllib.parse import unquote
 import json
 import os
-from config import KnowledgeBase, UserKnowledgeBase
+from config import KnowledgeBase, UserKnowledgeBase, TraceLevel, TraceLevels
 from motor_inferencia import (
     cargar_base_conocimiento,
     seleccionar_categoria,
     seleccionar_observable,
     obtener_preguntas_candidatas,
-    ejecutar_diagnostico
+    ejecutar_diagnostico,
+    explicar_traza
 )
 # 'is_yes' es necesario para la lógica del motor, 'normalize_text' para las claves
 from utils import normalize_text, is_yes
@@ -18,6 +19,34 @@ app = Flask(__name__)
 # ¡IMPORTANTE! Genera una clave segura y única para la producción
 app.secret_key = 'super_clave_secreta_!23456' 
 
+# Caché de bases de conocimiento: {archivo: (version, datos_bc)}
+# La versión es (st_mtime_ns, st_size) para detectar escrituras en el mismo instante
+_kb_cache = {}
+
+def cargar_bc_cacheada(filename: str):
+    """
+    Carga la BC desde el archivo solo si cambió desde la última lectura.
+    Los datos retornados son compartidos: no deben modificarse.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return cargar_base_conocimiento(filename)
+    version = (st.st_mtime_ns, st.st_size)
+
+    cached = _kb_cache.get(filename)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    bc = cargar_base_conocimiento(filename)
+    if bc:
+        _kb_cache[filename] = (version, bc)
+    return bc
+
+def version_bc_cacheada(filename: str) -> list | None:
+    """Retorna la versión [st_mtime_ns, st_size] de la BC cacheada, o None si no está en caché."""
+    cached = _kb_cache.get(filename)
+    return list(cached[0]) if cached else None
 
 def get_active_kb():
     """
@@ -28,18 +57,32 @@ def get_active_kb():
     
     if kb_name == 'user' and os.path.exists(UserKnowledgeBase):
         # Cargar la base de usuario si existe
-        bc = cargar_base_conocimiento(UserKnowledgeBase)
+        bc = cargar_bc_cacheada(UserKnowledgeBase)
         if bc:
             return bc, 'user'
             
     # Fallback: Cargar la base estándar
-    bc_base = cargar_base_conocimiento(KnowledgeBase)
+    bc_base = cargar_bc_cacheada(KnowledgeBase)
     if kb_name == 'user':
         # Si queríamos 'user' pero no existía, lo indicamos en la sesión
         session['kb_name'] = 'base'
         
     return bc_base, 'base'
 
+def get_diagnosis_kb(diagnostico: dict):
+    """
+    Retorna la BC con la que se generó el diagnóstico (los índices de la traza dependen de ella).
+    Retorna None si el archivo ya no existe o cambió desde el diagnóstico.
+    """
+    filename = UserKnowledgeBase if diagnostico.get('kb_name') == 'user' else KnowledgeBase
+    if not os.path.exists(filename):
+        return None
+
+    bc = cargar_bc_cacheada(filename)
+    if not bc or version_bc_cacheada(filename) != diagnostico.get('kb_version'):
+        return None
+    return bc
+
 def check_logical_duplicate(bc, sintoma, claves_premisas: list) -> tuple[bool, str]:
     """
     Verifica si ya existe una regla con el mismo síntoma y
@@ -195,8 +238,15 @@ def ask_questions():
         session['answers'] = answers
         
         # 3. Ejecutar diagnóstico
-        diagnostico = ejecutar_diagnostico(BC, selected_cat, selected_obs, answers)
+        # En la sesión solo se guarda la traza compacta; la explicación
+        # legible se reconstruye bajo demanda (ver /api/diagnosis/trace)
+        nivel = TraceLevel if TraceLevel in TraceLevels else 'resumen'
+        diagnostico = ejecutar_diagnostico(BC, selected_cat, selected_obs, answers,
+                                           registrar_traza=(nivel != 'ninguna'))
+        diagnostico['kb_name'] = kb_name
+        diagnostico['kb_version'] = version_bc_cacheada(UserKnowledgeBase if kb_name == 'user' else KnowledgeBase)
         session['diagnostico'] = diagnostico
+        session['nivel_traza'] = nivel
         return redirect(url_for('show_diagnosis'))
     
     # GET: Mostrar el formulario de preguntas
@@ -206,15 +256,54 @@ def ask_questions():
 def show_diagnosis():
     """Paso 5: Mostrar el resultado del Diagnóstico."""
     
-    BC, kb_name = get_active_kb()
-    user_kb_exists = os.path.exists(UserKnowledgeBase)
-    
     diagnostico = session.get('diagnostico')
     
     if not diagnostico:
         return redirect(url_for('select_category'))
+
+    # Materializar la traza legible solo para mostrarla (no se guarda en sesión)
+    nivel = session.get('nivel_traza', 'resumen')
+    traza = []
+    if nivel != 'ninguna' and diagnostico.get('traza') is not None:
+        BC = get_diagnosis_kb(diagnostico)
+        if BC:
+            traza = explicar_traza(BC, diagnostico['traza'],
+                                   session.get('answers', {}),
+                                   completa=(nivel == 'completa'))
+        else:
+            traza = None
         
-    return render_template('index.html', step=4, diagnostico=diagnostico)
+    # traza None -> la BC cambió y la explicación ya no es confiable
+    return render_template('index.html', step=4, diagnostico=diagnostico, traza=traza, nivel_traza=nivel)
+
+@app.route('/api/diagnosis/trace')
+def get_diagnosis_trace():
+    """API endpoint para obtener la explicación del último diagnóstico bajo demanda."""
+    
+    diagnostico = session.get('diagnostico')
+
+    if not diagnostico:
+        return {'success': False, 'error': 'No hay diagnóstico en la sesión', 'traza': []}, 404
+
+    nivel = request.args.get('nivel', 'completa')
+    if nivel not in ('resumen', 'completa'):
+        return {'success': False, 'error': f'Nivel de traza inválido: {nivel}', 'traza': []}, 400
+
+    BC = get_diagnosis_kb(diagnostico)
+    traza = None
+    if BC:
+        traza = explicar_traza(BC, diagnostico.get('traza') or [],
+                               session.get('answers', {}),
+                               completa=(nivel == 'completa'))
+
+    if traza is None:
+        return {'success': False, 'error': 'La base de conocimiento cambió desde el diagnóstico; traza no disponible', 'traza': []}, 409
+
+    return {
+        'success': True,
+        'nivel': nivel,
+        'traza': traza
+    }
 
 @app.route('/add-knowledge', methods=['GET', 'POST'])
 def add_knowledge():
@@ -1,2 +1,5 @@
 KnowledgeBase="knowledge_base.json"
-UserKnowledgeBase = "knowledge_user.json"
\ No newline at end of file
+UserKnowledgeBase = "knowledge_user.json"
+# Niveles de presentación de la trazabilidad del diagnóstico
+TraceLevels = ("ninguna", "resumen", "completa")
+TraceLevel = "resumen"
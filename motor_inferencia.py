@@ -75,28 +75,48 @@ def obtener_preguntas_candidatas(bc: dict, selected_obs: str) -> tuple[list, lis
 
     return reglas_candidatas, pregunta_items
 
-def ejecutar_diagnostico(bc: dict, selected_cat: str, selected_obs: str, answers: dict) -> dict:
+# Razones de aceptación/rechazo; la traza compacta guarda solo el índice
+RAZONES = (
+    "No hay confirmaciones suficientes.",
+    "Todas las premisas respondidas y verdaderas.",
+    "Alguna pregunta específica del observable confirmó la hipótesis (no hay premisas).",
+    "Alguna pregunta específica del observable confirmó la hipótesis.",
+)
+
+def _clave_pregunta(q: dict) -> str:
+    """Retorna la clave con la que se guarda la respuesta de una pregunta."""
+    qclave = q.get("clave")
+    return qclave if qclave else normalize_text(q.get("texto", ""))
+
+def ejecutar_diagnostico(bc: dict, selected_cat: str, selected_obs: str, answers: dict, registrar_traza: bool = True) -> dict:
     """
     Ejecuta el proceso de inferencia para obtener el diagnóstico.
     Evalúa las respuestas (answers) pre-existentes (que deben ser booleanas).
+
+    La traza se registra solo en forma compacta (índice de regla + máscaras de bits);
+    la explicación legible se obtiene con explicar_traza. Si registrar_traza es False,
+    "traza" es None.
     """
     reglas = bc.get("reglas", [])
-    
-    reglas_candidatas = [r for r in reglas if r.get("sintoma_observable", "").lower() == selected_obs.lower()]
+    obs_norm = selected_obs.lower()
 
     trazas = []
     diagnostico = None
 
-    for regla in reglas_candidatas:
+    for idx, regla in enumerate(reglas):
+        if regla.get("sintoma_observable", "").lower() != obs_norm:
+            continue
+
         hipotesis = regla.get("hipotesis")
         dominio = regla.get("dominio")
         premisas = regla.get("premisas", [])
         preguntas = regla.get("preguntas", [])
 
-        premisas_result = {}
-        all_premisas_satisfied = True
-        
-        for p in premisas:
+        # Bit i -> premisa i respondida / verdadera
+        premisas_resp = 0
+        premisas_ok = 0
+
+        for i, p in enumerate(premisas):
             clave = p.get("clave")
             val = answers.get(clave)
             
@@ -118,58 +138,55 @@ def ejecutar_diagnostico(bc: dict, selected_cat: str, selected_obs: str, answers
                     elif is_no(val):
                         p_res = False
 
-            premisas_result[clave] = p_res
-            if p_res is not True:
-                all_premisas_satisfied = False
+            if p_res is not None:
+                premisas_resp |= 1 << i
+                if p_res:
+                    premisas_ok |= 1 << i
+
+        all_premisas_satisfied = premisas_ok == (1 << len(premisas)) - 1
 
-        confirmaciones = []
-        respuestas_regla = []
-        any_confirmation = False
+        # Bit i -> pregunta i usada / confirmada
+        preguntas_usadas = 0
+        preguntas_conf = 0
         
-        for q in preguntas:
-            qclave = q.get("clave")
-            qtexto = q.get("texto", "")
-            key = qclave if qclave else normalize_text(qtexto)
+        for i, q in enumerate(preguntas):
+            resp = answers.get(_clave_pregunta(q))
             
-            resp = answers.get(key)
-            used = resp is not None
-            conf = False
-            
-            if used:
-                conf = evaluar_respuesta_confirmatoria(resp)
-                confirmaciones.append(conf)
-                if conf:
-                    any_confirmation = True
-            
-            respuestas_regla.append({"pregunta": qtexto, "respuesta": resp, "usada": used, "confirmada": conf})
+            if resp is not None:
+                preguntas_usadas |= 1 << i
+                if evaluar_respuesta_confirmatoria(resp):
+                    preguntas_conf |= 1 << i
+
+        any_confirmation = preguntas_conf != 0
 
         acepta = False
-        razon = "No hay confirmaciones suficientes."
+        razon = 0
         
         if premisas and all_premisas_satisfied:
             acepta = True
-            razon = "Todas las premisas respondidas y verdaderas."
+            razon = 1
         elif not premisas and any_confirmation:
             acepta = True
-            razon = "Alguna pregunta específica del observable confirmó la hipótesis (no hay premisas)."
+            razon = 2
         elif any_confirmation and not all_premisas_satisfied:
             acepta = True
-            razon = "Alguna pregunta específica del observable confirmó la hipótesis."
+            razon = 3
         
-        trazas.append({
-            "hipotesis": hipotesis,
-            "dominio": dominio,
-            "premisas_evaluadas": premisas_result,
-            "respuestas_regla": respuestas_regla,
-            "confirmaciones": confirmaciones,
-            "aceptada": acepta,
-            "razon": razon
-        })
+        if registrar_traza:
+            trazas.append({
+                "regla": idx,
+                "hipotesis": hipotesis,
+                "premisas": [premisas_resp, premisas_ok],
+                "preguntas": [preguntas_usadas, preguntas_conf],
+                "aceptada": acepta,
+                "razon": razon
+            })
 
         if acepta:
             # (NUEVO) Combinar 'acciones' y 'recomendada_para_usuario'
             # para dar compatibilidad hacia atrás con JSONs antiguos.
-            acciones_finales = regla.get("acciones", [])
+            # Se copia la lista para no modificar la BC (puede estar cacheada).
+            acciones_finales = list(regla.get("acciones", []))
             recomendacion_antigua = regla.get("recomendada_para_usuario")
             
             if recomendacion_antigua and (recomendacion_antigua not in acciones_finales):
@@ -180,7 +197,6 @@ def ejecutar_diagnostico(bc: dict, selected_cat: str, selected_obs: str, answers
                 "acciones": acciones_finales, # <-- Lista combinada
                 "dominio": dominio,
                 # "recomendada_para_usuario" ya no se pasa
-                "traza": trazas
             }
             break
 
@@ -189,8 +205,62 @@ def ejecutar_diagnostico(bc: dict, selected_cat: str, selected_obs: str, answers
             "causa_probable": "No determinada",
             "acciones": ["Revisar otras hipótesis; compartir respuestas y trazabilidad con soporte técnico."],
             "dominio": selected_cat,
-            "traza": trazas
         }
+
+    diagnostico["traza"] = trazas if registrar_traza else None
     
     return diagnostico
 
+def explicar_traza(bc: dict, traza: list, answers: dict | None = None, completa: bool = True) -> list | None:
+    """
+    Reconstruye la explicación legible a partir de la traza compacta.
+    Con completa=False solo retorna hipótesis, dominio, aceptación y razón.
+    Si no se pasan las respuestas originales, se usa el valor booleano de la máscara.
+    Retorna None si la traza no corresponde a la BC (índice inexistente o hipótesis distinta).
+    """
+    reglas = bc.get("reglas", [])
+    explicacion = []
+
+    for t in traza:
+        idx = t.get("regla")
+        if not isinstance(idx, int) or not 0 <= idx < len(reglas):
+            return None
+        regla = reglas[idx]
+        if regla.get("hipotesis") != t.get("hipotesis"):
+            return None
+
+        item = {
+            "hipotesis": regla.get("hipotesis"),
+            "dominio": regla.get("dominio"),
+            "aceptada": t.get("aceptada", False),
+            "razon": RAZONES[t.get("razon", 0)]
+        }
+
+        if completa:
+            premisas_resp, premisas_ok = t.get("premisas", [0, 0])
+            preguntas_usadas, preguntas_conf = t.get("preguntas", [0, 0])
+
+            premisas_result = {}
+            for i, p in enumerate(regla.get("premisas", [])):
+                bit = 1 << i
+                premisas_result[p.get("clave")] = bool(premisas_ok & bit) if premisas_resp & bit else None
+
+            respuestas_regla = []
+            confirmaciones = []
+            for i, q in enumerate(regla.get("preguntas", [])):
+                bit = 1 << i
+                used = bool(preguntas_usadas & bit)
+                conf = bool(preguntas_conf & bit)
+                resp = None
+                if used:
+                    confirmaciones.append(conf)
+                    resp = answers.get(_clave_pregunta(q), conf) if answers is not None else conf
+                respuestas_regla.append({"pregunta": q.get("texto", ""), "respuesta": resp, "usada": used, "confirmada": conf})
+
+            item["premisas_evaluadas"] = premisas_result
+            item["respuestas_regla"] = respuestas_regla
+            item["confirmaciones"] = confirmaciones
+
+        explicacion.append(item)
+
+    return explicacion